@@ -2,7 +2,6 @@ import streamlit as st
 import os
 import time
 import json
-from datetime import datetime
 import random
 
 # --- CONFIGURAZIONE PAGINA ---
@@ -87,19 +86,40 @@ def safe_image(url_or_path, caption, **kwargs):
             </div>
         """, unsafe_allow_html=True)
 
+total_steps = 9  # Steps 1-9, step 0 is welcome, step 10 is finale
+
+# --- TEMPI PER STEP (CLOCK MONOTONO) ---
+def leave_step():
+    """Accumula il tempo passato sullo step corrente e fa ripartire il cronometro"""
+    now = time.monotonic()
+    key = f"step{st.session_state.step}"
+    st.session_state.step_times[key] = st.session_state.step_times.get(key, 0.0) + (now - st.session_state.step_entered)
+    st.session_state.step_entered = now
+
+def step_durations():
+    """Durata in secondi di ogni sfida completata (step 1-9), in ordine"""
+    return {f"step{i}": st.session_state.step_times[f"step{i}"]
+            for i in range(1, total_steps + 1) if f"step{i}" in st.session_state.step_times}
+
+def format_duration(seconds):
+    return f"{int(seconds // 60)}m {int(seconds % 60)}s"
+
 # --- PERSISTENZA STATO (JSON) ---
 STATE_FILE = os.path.join(os.path.dirname(__file__), "quiz_state.json")
 
 def save_state():
     """Salva lo stato corrente su file JSON"""
+    if "step_times" in st.session_state:
+        leave_step()  # Include il tempo già passato sullo step in corso
     state_to_save = {
         "step": st.session_state.get("step", 0),
         "attempts": st.session_state.get("attempts", {}),
         "hints_used": st.session_state.get("hints_used", 0),
         "perfect_score": st.session_state.get("perfect_score", True),
         "show_photo": st.session_state.get("show_photo", {}),
+        "throttled": st.session_state.get("throttled", 0),
         "hints_shown": {k: v for k, v in st.session_state.items() if k.startswith("hint_shown_")},
-        "start_time": st.session_state.get("start_time", datetime.now()).isoformat(),
+        "step_times": st.session_state.get("step_times", {}),
     }
     try:
         with open(STATE_FILE, "w", encoding="utf-8") as f:
@@ -118,7 +138,9 @@ def load_state():
             st.session_state.hints_used = saved.get("hints_used", 0)
             st.session_state.perfect_score = saved.get("perfect_score", True)
             st.session_state.show_photo = saved.get("show_photo", {})
-            st.session_state.start_time = datetime.fromisoformat(saved.get("start_time", datetime.now().isoformat()))
+            st.session_state.throttled = saved.get("throttled", 0)
+            st.session_state.step_times = saved.get("step_times", {})  # Include lo step in corso fino all'ultimo salvataggio
+            st.session_state.step_entered = time.monotonic()
             for k, v in saved.get("hints_shown", {}).items():
                 st.session_state[k] = v
             return True
@@ -139,10 +161,12 @@ if 'initialized' not in st.session_state:
     clear_saved_state()  # Always start fresh on new run
     st.session_state.step = 0  # Step 0 = Welcome screen
     st.session_state.attempts = {}
-    st.session_state.start_time = datetime.now()
+    st.session_state.step_times = {}
+    st.session_state.step_entered = time.monotonic()
     st.session_state.hints_used = 0
     st.session_state.perfect_score = True
     st.session_state.show_photo = {}
+    st.session_state.throttled = 0
     st.session_state.initialized = True
 
 # Ensure all keys exist (in case loaded state is from an older version)
@@ -150,16 +174,44 @@ if 'step' not in st.session_state:
     st.session_state.step = 0
 if 'attempts' not in st.session_state:
     st.session_state.attempts = {}
-if 'start_time' not in st.session_state:
-    st.session_state.start_time = datetime.now()
+if 'step_times' not in st.session_state:
+    st.session_state.step_times = {}
+if 'step_entered' not in st.session_state:
+    st.session_state.step_entered = time.monotonic()
 if 'hints_used' not in st.session_state:
     st.session_state.hints_used = 0
 if 'perfect_score' not in st.session_state:
     st.session_state.perfect_score = True
 if 'show_photo' not in st.session_state:
     st.session_state.show_photo = {}
+if 'throttled' not in st.session_state:
+    st.session_state.throttled = 0
+
+# --- LIMITE INVII (TOKEN BUCKET PER SESSIONE) ---
+RATE_LIMIT_BURST = 5         # Invii consecutivi consentiti
+RATE_LIMIT_REFILL = 1.0      # Gettoni recuperati al secondo
+
+def allow_submission():
+    """Consuma un gettone per una risposta o un aiutino; False se la sessione va troppo veloce.
+
+    Il conteggio resta solo in memoria: un invio bloccato non scrive mai su disco.
+    """
+    now = time.monotonic()
+    bucket = st.session_state.get("rate_bucket")
+    if bucket is None:
+        bucket = {"tokens": float(RATE_LIMIT_BURST), "updated": now}
+        st.session_state.rate_bucket = bucket
+    bucket["tokens"] = min(RATE_LIMIT_BURST, bucket["tokens"] + (now - bucket["updated"]) * RATE_LIMIT_REFILL)
+    bucket["updated"] = now
+    if bucket["tokens"] >= 1:
+        bucket["tokens"] -= 1
+        return True
+    st.session_state.throttled += 1
+    st.toast("Piano piano! Aspetta un attimo prima di riprovare 🐢", icon="⏳")
+    return False
 
 def go_next():
+    leave_step()
     st.session_state.step += 1
     save_state()
     time.sleep(0.3)
@@ -178,13 +230,14 @@ def show_hint(hint_text, step_key):
     if st.button("💡 Aiutino?", key=f"hint_btn_{step_key}"):
         flag = f"hint_shown_{step_key}"
         if flag not in st.session_state:
+            if not allow_submission():  # Solo la prima richiesta scrive su disco e consuma un gettone
+                return
             st.session_state.hints_used += 1
             st.session_state[flag] = True
             save_state()
         st.markdown(f"<div class='hint-box'>💭 {hint_text}</div>", unsafe_allow_html=True)
 
 # --- BARRA PROGRESSO ---
-total_steps = 9  # Steps 1-9, step 0 is welcome, step 10 is finale
 if st.session_state.step > 0 and st.session_state.step <= total_steps:
     progress = st.session_state.step / total_steps
     col_prog1, col_prog2 = st.columns([4, 1])
@@ -218,7 +271,6 @@ if st.session_state.step == 0:
         """, unsafe_allow_html=True)
         
         if st.button("❤️ Cominciamo botolina!", key="start_quiz", use_container_width=True):
-            st.session_state.start_time = datetime.now()
             go_next()
 
 # =============================================================================
@@ -249,7 +301,7 @@ elif st.session_state.step == 1:
         for i in range(0, len(cities), 2):
             city_name, city_img = cities[i]
             safe_image(city_img, city_name, use_container_width=True)
-            if st.button(f"Scegli {city_name}", key=f"city1_{i}"):
+            if st.button(f"Scegli {city_name}", key=f"city1_{i}") and allow_submission():
                 if city_name == citta_corretta:
                     track_attempt("step1", correct=True)
                     st.toast(f"Fregt se è giusta! {citta_corretta}!", icon="✅")
@@ -264,7 +316,7 @@ elif st.session_state.step == 1:
         for i in range(1, len(cities), 2):
             city_name, city_img = cities[i]
             safe_image(city_img, city_name, use_container_width=True)
-            if st.button(f"Scegli {city_name}", key=f"city1_{i}"):
+            if st.button(f"Scegli {city_name}", key=f"city1_{i}") and allow_submission():
                 if city_name == citta_corretta:
                     track_attempt("step1", correct=True)
                     st.toast(f"Esatto! {citta_corretta}! ❤️", icon="✅")
@@ -303,7 +355,7 @@ elif st.session_state.step == 2:
         for i in range(0, len(cities), 2):
             city_name, city_img = cities[i]
             safe_image(city_img, city_name, use_container_width=True)
-            if st.button(f"Scegli {city_name}", key=f"city2_{i}"):
+            if st.button(f"Scegli {city_name}", key=f"city2_{i}") and allow_submission():
                 if city_name == citta_corretta:
                     st.session_state.show_photo['step2'] = True
                     track_attempt("step2", correct=True)
@@ -318,7 +370,7 @@ elif st.session_state.step == 2:
         for i in range(1, len(cities), 2):
             city_name, city_img = cities[i]
             safe_image(city_img, city_name, use_container_width=True)
-            if st.button(f"Scegli {city_name}", key=f"city2_{i}"):
+            if st.button(f"Scegli {city_name}", key=f"city2_{i}") and allow_submission():
                 if city_name == citta_corretta:
                     st.session_state.show_photo['step2'] = True
                     track_attempt("step2", correct=True)
@@ -366,7 +418,7 @@ elif st.session_state.step == 3:
         for i in range(0, len(cities), 2):
             city_name, city_img = cities[i]
             safe_image(city_img, city_name, use_container_width=True)
-            if st.button(f"Scegli {city_name}", key=f"city3_{i}"):
+            if st.button(f"Scegli {city_name}", key=f"city3_{i}") and allow_submission():
                 if city_name == citta_corretta:
                     track_attempt("step3", correct=True)
                     st.toast(f"Esatto! {citta_corretta}! 🌴", icon="✅")
@@ -381,7 +433,7 @@ elif st.session_state.step == 3:
         for i in range(1, len(cities), 2):
             city_name, city_img = cities[i]
             safe_image(city_img, city_name, use_container_width=True)
-            if st.button(f"Scegli {city_name}", key=f"city3_{i}"):
+            if st.button(f"Scegli {city_name}", key=f"city3_{i}") and allow_submission():
                 if city_name == citta_corretta:
                     track_attempt("step3", correct=True)
                     st.toast(f"Esatto! {citta_corretta}! 🌴", icon="✅")
@@ -409,18 +461,18 @@ elif st.session_state.step == 4:
 
     with col1:
         safe_image(img1, "Bulldog", use_container_width=True)
-        if st.button("Scegli Bulldog", key="dog1"): 
+        if st.button("Scegli Bulldog", key="dog1") and allow_submission():
             track_attempt("step4", correct=False)
             st.toast("Assolutamente no!", icon="❌")
             
         safe_image(img3, "Succhetto", use_container_width=True)
-        if st.button("Scegli Succhetto", key="dog3"): 
+        if st.button("Scegli Succhetto", key="dog3") and allow_submission():
             track_attempt("step4", correct=False)
             st.toast("No! Ma vicino!", icon="❌")
 
     with col2:
         safe_image(img2, "Poldo", use_container_width=True)
-        if st.button("Scegli Poldo", key="dog2"):
+        if st.button("Scegli Poldo", key="dog2") and allow_submission():
             track_attempt("step4", correct=True)
             st.toast("La devozione fatta cane!", icon="✅")
             st.balloons()
@@ -428,7 +480,7 @@ elif st.session_state.step == 4:
             go_next()
             
         safe_image(img4, "Beagle", use_container_width=True)
-        if st.button("Scegli Beagle", key="dog4"): 
+        if st.button("Scegli Beagle", key="dog4") and allow_submission():
             track_attempt("step4", correct=False)
             st.toast("Troppo casino!", icon="❌")
     
@@ -456,7 +508,7 @@ elif st.session_state.step == 5:
     
     st.markdown(f"<div style='text-align: center; font-size: 2rem;'>{emoji} {msg}</div>", unsafe_allow_html=True)
     
-    if st.button("Conferma", key="step5_btn"):
+    if st.button("Conferma", key="step5_btn") and allow_submission():
         if valore == 100:
             track_attempt("step5", correct=True)
             st.toast("Risposta corretta! ❤️", icon="✅")
@@ -479,7 +531,7 @@ elif st.session_state.step == 6:
     opzioni = ["Sir botulus", "Stupido botolo", "Botolo", "Dottore bis"]
     scelta = st.radio("Scegli:", opzioni, index=None, key="song_radio")
     
-    if st.button("Verifica", key="step6_btn"):
+    if st.button("Verifica", key="step6_btn") and allow_submission():
         if scelta == "Botolo":
             st.session_state.show_photo['step6'] = True
             track_attempt("step6", correct=True)
@@ -517,7 +569,7 @@ elif st.session_state.step == 7:
     
     scelta = st.radio("Le mie parole:", opzioni, index=None, key="memory_radio")
     
-    if st.button("Conferma", key="step7_btn"):
+    if st.button("Conferma", key="step7_btn") and allow_submission():
         if scelta == "ma duro che duri!":
             track_attempt("step7", correct=True)
             st.toast("Gennari sarebbe fiero! 🥰", icon="✅")
@@ -539,7 +591,7 @@ elif st.session_state.step == 8:
     
     pw = st.text_input("Password:", type="password", key="password_input")
     
-    if st.button("Sblocca", key="step8_btn"):
+    if st.button("Sblocca", key="step8_btn") and allow_submission():
         if pw.lower().strip() in ["amore", "tips", "botola", "disco"]:
             st.session_state.show_photo['step8'] = True
             track_attempt("step8", correct=True)
@@ -579,7 +631,7 @@ elif st.session_state.step == 9:
     
     scelta = st.radio("La mia dedica:", opzioni, index=None, key="song_dedica_radio")
     
-    if st.button("Conferma", key="step9_btn"):
+    if st.button("Conferma", key="step9_btn") and allow_submission():
         if scelta == canzone_corretta:
             st.session_state.show_photo['step9'] = True
             track_attempt("step9", correct=True)
@@ -603,9 +655,8 @@ elif st.session_state.step == 9:
 # FINALE
 # =============================================================================
 elif st.session_state.step == 10:
-    elapsed_time = datetime.now() - st.session_state.start_time
-    minutes = int(elapsed_time.total_seconds() / 60)
-    seconds = int(elapsed_time.total_seconds() % 60)
+    durations = step_durations()
+    elapsed_seconds = sum(durations.values())
     total_attempts = sum(st.session_state.attempts.values())
     
     st.markdown("<h1 style='text-align: center; color: #c0392b; margin-bottom: 30px;'>Buon San Valentino! 🌹</h1>", unsafe_allow_html=True)
@@ -613,7 +664,7 @@ elif st.session_state.step == 10:
     # --- Animated Stat Reveal ---
     col_stat1, col_stat2, col_stat3 = st.columns(3)
     with col_stat1:
-        st.markdown(f"<div class='counter-badge stat-reveal stat-reveal-1'>⏱️ {minutes}m {seconds}s</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='counter-badge stat-reveal stat-reveal-1'>⏱️ {format_duration(elapsed_seconds)}</div>", unsafe_allow_html=True)
     with col_stat2:
         if st.session_state.perfect_score:
             st.markdown("<div class='counter-badge stat-reveal stat-reveal-2'>🏆 Punteggio Perfetto!</div>", unsafe_allow_html=True)
@@ -621,6 +672,15 @@ elif st.session_state.step == 10:
             st.markdown(f"<div class='counter-badge stat-reveal stat-reveal-2'>❌ {total_attempts} errori</div>", unsafe_allow_html=True)
     with col_stat3:
         st.markdown(f"<div class='counter-badge stat-reveal stat-reveal-3'>💡 {st.session_state.hints_used} aiuti</div>", unsafe_allow_html=True)
+    if st.session_state.throttled:
+        st.markdown(f"<div class='counter-badge stat-reveal stat-reveal-3' style='text-align: center;'>🐢 {st.session_state.throttled} clic rallentati</div>", unsafe_allow_html=True)
+    
+    if durations:
+        with st.expander("⏱️ Quanto tempo per ogni sfida?"):
+            slowest = max(durations, key=durations.get)
+            for step_key, secs in durations.items():
+                marker = " 🐢" if step_key == slowest else ""
+                st.write(f"Sfida {step_key[4:]}: {format_duration(secs)}{marker}")
     
     st.write("")
     